@@ -1,3 +1,8 @@
+import os
 # Make sure all network classes get initialized so they actually exist in our
 # magic networks module
 import cckit._networks as _  # noqa
+
+if os.environ.get('CCKIT_PROFILE'):
+    from cckit.profiling import enable_from_env
+    enable_from_env(os.environ)
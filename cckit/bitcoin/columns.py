@@ -0,0 +1,176 @@
+import struct
+
+from array import array
+
+from .encoding import VARINT_FORMATS, varint_from_buffer, uint64_typecode
+# NumPy is optional, without it columns are decoded with a plain Python loop
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BLOCK_HEADER_SIZE = 80
+
+COLUMNS = ('version', 'input_count', 'output_count', 'locktime', 'amount',
+           'output_tx')
+
+
+class TransactionFrame(object):
+    """ Offset table from a framing pass over serialized transactions. Only
+    the positions needed to pull out columns are recorded, nothing is
+    decoded into objects. """
+
+    def __init__(self):
+        # Start of each transaction
+        self.tx_offsets = array(uint64_typecode)
+        # Position of each transaction's output count
+        self.output_count_offsets = array(uint64_typecode)
+        # Start of each output, and the index of the transaction it's in
+        self.output_offsets = array(uint64_typecode)
+        self.output_tx = array(uint64_typecode)
+        # End of each transaction, its locktime is the last four bytes
+        self.tx_ends = array(uint64_typecode)
+
+    def __len__(self):
+        return len(self.tx_offsets)
+
+
+def frame_transactions(buf, count=None, offset=0):
+    """ Walks `count` back to back network serialized transactions in `buf`
+    starting at `offset`, or until the end of the buffer if `count` is None,
+    and returns their `TransactionFrame`. Only the legacy serialization is
+    understood, segwit transactions raise rather than being misframed. """
+    frame = TransactionFrame()
+    end = len(buf)
+    tx_idx = 0
+    while (offset < end) if count is None else (tx_idx < count):
+        frame.tx_offsets.append(offset)
+        input_count, offset = varint_from_buffer(buf, offset + 4)
+        # Legacy transactions always have an input, a zero count is the
+        # segwit marker and framing past it would misread everything after
+        if not input_count:
+            raise Exception("Transaction {} has no inputs, segwit "
+                            "serialization isn't supported".format(tx_idx))
+        for _ in range(input_count):
+            script_len, offset = varint_from_buffer(buf, offset + 36)
+            offset += script_len + 4
+        frame.output_count_offsets.append(offset)
+        output_count, offset = varint_from_buffer(buf, offset)
+        for _ in range(output_count):
+            frame.output_offsets.append(offset)
+            frame.output_tx.append(tx_idx)
+            script_len, offset = varint_from_buffer(buf, offset + 8)
+            offset += script_len
+        offset += 4
+        if offset > end:
+            raise Exception("Transaction {} runs past the end of the buffer"
+                            .format(tx_idx))
+        frame.tx_ends.append(offset)
+        tx_idx += 1
+    return frame
+
+
+def frame_block(buf, offset=0):
+    """ Frames the transactions of a serialized block whose header starts at
+    `offset` """
+    count, offset = varint_from_buffer(buf, offset + BLOCK_HEADER_SIZE)
+    return frame_transactions(buf, count, offset)
+
+
+def decode_columns(buf, frame, columns=COLUMNS, use_numpy=True):
+    """ Extracts the requested columns for every transaction (or output, for
+    `amount` and `output_tx`) in `frame`. Returns a dict of NumPy arrays
+    built with vectorized gathers when NumPy is available, otherwise of
+    `array.array` columns decoded in Python. """
+    for column in columns:
+        if column not in COLUMNS:
+            raise ValueError("Unknown column {}".format(column))
+    if np is not None and use_numpy:
+        return _decode_numpy(buf, frame, columns)
+    return _decode_python(buf, frame, columns)
+
+
+def _decode_python(buf, frame, columns):
+    unpack_from = struct.unpack_from
+    uint64 = uint64_typecode
+    ret = {}
+    for column in columns:
+        if column == 'version':
+            ret[column] = array('I', (unpack_from("<L", buf, off)[0]
+                                      for off in frame.tx_offsets))
+        elif column == 'locktime':
+            ret[column] = array('I', (unpack_from("<L", buf, off - 4)[0]
+                                      for off in frame.tx_ends))
+        elif column == 'input_count':
+            ret[column] = array(uint64, (varint_from_buffer(buf, off + 4)[0]
+                                         for off in frame.tx_offsets))
+        elif column == 'output_count':
+            offsets = frame.output_count_offsets
+            ret[column] = array(uint64, (varint_from_buffer(buf, off)[0]
+                                         for off in offsets))
+        elif column == 'amount':
+            ret[column] = array(uint64, (unpack_from("<Q", buf, off)[0]
+                                         for off in frame.output_offsets))
+        elif column == 'output_tx':
+            ret[column] = array(uint64, frame.output_tx)
+    return ret
+
+
+def _offsets(arr):
+    return np.frombuffer(arr, dtype=np.uint64) if len(arr) else \
+        np.zeros(0, dtype=np.uint64)
+
+
+def _gather(data, offsets, width):
+    """ Pulls `width` bytes at every offset into a (len(offsets), width)
+    array. Indexes past the end of the buffer are clamped, callers must mask
+    out any bytes that don't belong to the field. """
+    if not len(data) or not len(offsets):
+        return np.zeros((len(offsets), width), dtype=np.uint8)
+    idx = offsets[:, None] + np.arange(width, dtype=np.uint64)
+    np.minimum(idx, len(data) - 1, out=idx)
+    return data[idx]
+
+
+def _gather_fixed(data, offsets, dtype):
+    dtype = np.dtype(dtype)
+    raw = _gather(data, offsets, dtype.itemsize)
+    return np.ascontiguousarray(raw).view(dtype).reshape(-1).astype(
+        dtype.newbyteorder('='))
+
+
+def _gather_varint(data, offsets):
+    raw = _gather(data, offsets, 9).astype(np.uint64)
+    prefix = raw[:, 0]
+    width = np.zeros(len(offsets), dtype=np.uint64)
+    for marker, (_, size) in VARINT_FORMATS.items():
+        width[prefix == marker] = size
+    shifts = np.arange(8, dtype=np.uint64) * np.uint64(8)
+    payload = np.where(np.arange(8, dtype=np.uint64) < width[:, None],
+                       raw[:, 1:] << shifts, np.uint64(0))
+    value = np.bitwise_or.reduce(payload, axis=1)
+    return np.where(width == 0, prefix, value)
+
+
+def _decode_numpy(buf, frame, columns):
+    data = np.frombuffer(buf, dtype=np.uint8) if len(buf) else \
+        np.zeros(0, dtype=np.uint8)
+    tx_offsets = _offsets(frame.tx_offsets)
+    ret = {}
+    for column in columns:
+        if column == 'version':
+            ret[column] = _gather_fixed(data, tx_offsets, '<u4')
+        elif column == 'locktime':
+            ret[column] = _gather_fixed(
+                data, _offsets(frame.tx_ends) - np.uint64(4), '<u4')
+        elif column == 'input_count':
+            ret[column] = _gather_varint(data, tx_offsets + np.uint64(4))
+        elif column == 'output_count':
+            ret[column] = _gather_varint(
+                data, _offsets(frame.output_count_offsets))
+        elif column == 'amount':
+            ret[column] = _gather_fixed(
+                data, _offsets(frame.output_offsets), '<u8')
+        elif column == 'output_tx':
+            ret[column] = _offsets(frame.output_tx).copy()
+    return ret
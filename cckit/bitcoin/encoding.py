@@ -6,8 +6,40 @@ from ..serialize import Streamer
 from hashlib import sha256
 if sys.version_info[0] >= 3:
     integer_class = int
+    # array typecode for unsigned 64 bit values
+    uint64_typecode = 'Q'
 else:
     integer_class = long
+    uint64_typecode = 'L'
+
+
+def array_to_bytes(arr):
+    """ `array.tobytes`, which is called `tostring` on Python 2 """
+    if hasattr(arr, 'tobytes'):
+        return arr.tobytes()
+    return arr.tostring()
+
+
+def array_from_bytes(arr, data):
+    """ `array.frombytes`, which is called `fromstring` on Python 2 """
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(bytes(data))
+
+
+# Varint rules shared by every reader and writer: values below the first
+# prefix are stored as a single byte, larger ones as (prefix byte, struct
+# format, payload size, largest value it can hold), narrowest first
+VARINT_SINGLE_BYTE_MAX = 252
+VARINT_ENCODINGS = (
+    (253, "<H", 2, 0xffff),
+    (254, "<L", 4, 0xffffffff),
+    (255, "<Q", 8, 0xffffffffffffffff),
+)
+# Prefix byte -> (struct format, payload size)
+VARINT_FORMATS = dict((prefix, (fmt, size))
+                      for prefix, fmt, size, _ in VARINT_ENCODINGS)
 
 
 class Int(Streamer, integer_class):
@@ -17,23 +49,41 @@ class Int(Streamer, integer_class):
     @classmethod
     def from_stream(cls, f):
         prefix = ord(f.read(1))
-        if prefix == 253:
-            return struct.unpack("<H", f.read(2))[0]
-        if prefix == 254:
-            return struct.unpack("<L", f.read(4))[0]
-        if prefix == 255:
-            return struct.unpack("<Q", f.read(8))[0]
-        return prefix
+        if prefix <= VARINT_SINGLE_BYTE_MAX:
+            return prefix
+        fmt, size = VARINT_FORMATS[prefix]
+        return struct.unpack(fmt, f.read(size))[0]
 
     def to_stream(self, f):
-        if self < 253:
+        if self <= VARINT_SINGLE_BYTE_MAX:
             f.write(struct.pack("<B", self))
-        elif self <= 65535:
-            f.write(b'\xfd' + struct.pack("<H", self))
-        elif self <= 0xffffffff:
-            f.write(b'\xfe' + struct.pack("<L", self))
-        else:
-            f.write(b'\xff' + struct.pack("<Q", self))
+            return
+        for prefix, fmt, _, maximum in VARINT_ENCODINGS:
+            if self <= maximum:
+                f.write(struct.pack("<B", prefix) + struct.pack(fmt, self))
+                return
+        raise ValueError("Int too large to encode")
+
+
+def varint_from_buffer(buf, offset):
+    """ Decodes an `Int` straight out of a buffer, returning the value and the
+    offset just past it """
+    prefix, = struct.unpack_from("<B", buf, offset)
+    offset += 1
+    if prefix <= VARINT_SINGLE_BYTE_MAX:
+        return prefix, offset
+    fmt, size = VARINT_FORMATS[prefix]
+    return struct.unpack_from(fmt, buf, offset)[0], offset + size
+
+
+def varint_size(v):
+    """ Number of bytes `Int(v)` takes up when serialized """
+    if v <= VARINT_SINGLE_BYTE_MAX:
+        return 1
+    for _, _, size, maximum in VARINT_ENCODINGS:
+        if v <= maximum:
+            return 1 + size
+    raise ValueError("Int too large to encode")
 
 
 class String(Streamer, bytes):
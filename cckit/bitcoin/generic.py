@@ -1,6 +1,7 @@
 import struct
 
 from .encoding import String, Int, Hash
+from .sighash import SignatureHasher
 from cckit.rpc import CoinRPC
 
 
@@ -86,6 +87,11 @@ class Transaction(object):
         decode it """
         return cls.from_network(f)
 
+    def signature_hasher(self):
+        """ Returns a `SignatureHasher` for computing the signature hashes of
+        this transaction's inputs """
+        return SignatureHasher(self)
+
 
 class RPCWrapper(CoinRPC):
     """
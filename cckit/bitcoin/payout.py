@@ -0,0 +1,269 @@
+import struct
+
+from .encoding import Int, String, Hash, varint_size
+from .generic import Transaction, Input, Output
+
+# Rough size of a signed P2PKH script_sig (signature + compressed pubkey),
+# used to size inputs before they're signed
+P2PKH_SCRIPT_SIG_SIZE = 107
+DUST_THRESHOLD = 546
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, needed, available):
+        self.needed = needed
+        self.available = available
+        super(InsufficientFunds, self).__init__(
+            "Need {} but only {} available".format(needed, available))
+
+
+def _input_size(script_sig_size):
+    return 32 + 4 + varint_size(script_sig_size) + script_sig_size + 4
+
+
+class PayoutBuilder(object):
+    """ Accumulates payout outputs while keeping a running serialized size of
+    the resulting transaction, so fees can be estimated without
+    re-serializing after every change. Payments to the same script are merged
+    into a single output.
+
+    Example usage::
+
+        >>> builder = PayoutBuilder(Bitcoin.transaction)
+        >>> builder.extend(credits)  # iterable of (script, amount)
+        >>> fee = builder.select_coins(utxos, fee_per_kb=10000,
+        ...                            change_script=pool_script)
+        >>> raw = builder.to_bytes()
+    """
+
+    def __init__(self, transaction_class=Transaction, version=1, locktime=0,
+                 seqno=0xffffffff):
+        self.transaction_class = transaction_class
+        self.version = version
+        self.locktime = locktime
+        self.seqno = seqno
+        # script -> [amount, serialized script]
+        self._outputs = {}
+        self._outputs_size = 0
+        self._total_out = 0
+        # (txid, idx, amount)
+        self._inputs = []
+        self._inputs_size = 0
+        self._script_sig_size = P2PKH_SCRIPT_SIG_SIZE
+        # Change output picked by `select_coins`, kept apart from the payees
+        # as [script, amount, serialized script]
+        self._change = None
+        # Whether the inputs were picked by `select_coins`
+        self._selected = False
+
+    def __len__(self):
+        """ Number of outputs, including any change output """
+        return len(self._outputs) + (self._change is not None)
+
+    @property
+    def size(self):
+        """ Serialized size in bytes the transaction will have once its
+        inputs are signed """
+        outputs_size = self._outputs_size
+        if self._change is not None:
+            outputs_size += 8 + len(self._change[2])
+        return (8 + varint_size(len(self._inputs)) + self._inputs_size +
+                varint_size(len(self)) + outputs_size)
+
+    @property
+    def total_out(self):
+        """ Total paid to payees, not counting change """
+        return self._total_out
+
+    @property
+    def change(self):
+        """ The (script, amount) change output, or None """
+        if self._change is None:
+            return None
+        return self._change[0], self._change[1]
+
+    @property
+    def total_in(self):
+        return sum(inpt[2] for inpt in self._inputs)
+
+    def fee(self, fee_per_kb):
+        """ Fee for the current size at `fee_per_kb` per 1000 bytes, rounded
+        up """
+        return -(-self.size * fee_per_kb // 1000)
+
+    # Outputs
+    def _outputs_changed(self):
+        """ Any inputs and change from `select_coins` were sized for the old
+        outputs, so they're dropped and have to be selected again """
+        if self._selected:
+            self._clear_selection()
+
+    def add(self, script, amount):
+        """ Pays `amount` to `script`, merging with any existing payment to
+        the same script """
+        if amount <= 0:
+            raise ValueError("Payout amount must be positive")
+        self._outputs_changed()
+        script = bytes(script)
+        self._total_out += amount
+        entry = self._outputs.get(script)
+        if entry is not None:
+            entry[0] += amount
+            return
+        encoded = String(script).to_bytes()
+        self._outputs[script] = [amount, encoded]
+        self._outputs_size += 8 + len(encoded)
+
+    def extend(self, payouts):
+        """ Adds every (script, amount) pair from an iterable """
+        for script, amount in payouts:
+            self.add(script, amount)
+
+    def remove(self, script):
+        """ Removes the output paying `script` and returns its amount """
+        amount, encoded = self._outputs.pop(bytes(script))
+        self._outputs_changed()
+        self._outputs_size -= 8 + len(encoded)
+        self._total_out -= amount
+        return amount
+
+    def subtract(self, script, amount):
+        """ Reduces the payment to `script`, removing the output when it
+        reaches zero """
+        if amount <= 0:
+            raise ValueError("Subtracted amount must be positive")
+        entry = self._outputs[bytes(script)]
+        if amount > entry[0]:
+            raise ValueError("Can't subtract more than the output amount")
+        self._outputs_changed()
+        entry[0] -= amount
+        self._total_out -= amount
+        if not entry[0]:
+            self.remove(script)
+
+    def amount(self, script):
+        entry = self._outputs.get(bytes(script))
+        return entry[0] if entry is not None else 0
+
+    def _sorted_outputs(self):
+        """ Outputs, including change, ordered by amount then script as in
+        BIP69 """
+        outputs = [(entry[0], script, entry[1])
+                   for script, entry in self._outputs.items()]
+        if self._change is not None:
+            script, amount, encoded = self._change
+            outputs.append((amount, script, encoded))
+        outputs.sort()
+        return outputs
+
+    def _sorted_inputs(self):
+        """ Inputs ordered by RPC byte order txid then index, as in BIP69 """
+        return sorted(self._inputs, key=lambda i: (i[0][::-1], i[1]))
+
+    # Inputs
+    def add_input(self, txid, idx, amount):
+        if not isinstance(txid, bytes):
+            txid = txid.internal_bo
+        self._inputs.append((txid, idx, amount))
+        self._inputs_size += _input_size(self._script_sig_size)
+
+    def _clear_selection(self):
+        self._inputs = []
+        self._inputs_size = 0
+        self._change = None
+        self._selected = False
+
+    def select_coins(self, utxos, fee_per_kb, change_script=None,
+                     script_sig_size=P2PKH_SCRIPT_SIG_SIZE,
+                     dust=DUST_THRESHOLD):
+        """ Picks inputs from `utxos`, an iterable of (txid, idx, amount, ...)
+        tuples such as a `UTXOSet` yields, largest first until the outputs
+        and fee are covered. Any remainder above `dust` is paid to
+        `change_script`, otherwise it's left as fee. Replaces any previous
+        selection and returns the fee paid. Adding, removing or changing a
+        payment afterwards drops the selection. """
+        if not self._outputs:
+            raise ValueError("No outputs to pay")
+        self._clear_selection()
+        self._script_sig_size = script_sig_size
+        candidates = sorted((utxo[:3] for utxo in utxos),
+                            key=lambda u: (-u[2], u[0], u[1]))
+        needed = self.total_out
+        total = 0
+        for txid, idx, amount in candidates:
+            self.add_input(txid, idx, amount)
+            total += amount
+            if total >= needed + self.fee(fee_per_kb):
+                break
+        else:
+            needed += self.fee(fee_per_kb)
+            self._clear_selection()
+            raise InsufficientFunds(needed, total)
+        self._selected = True
+
+        change = total - needed - self.fee(fee_per_kb)
+        if change_script is not None and change > dust:
+            # Size the fee with the change output in place before settling
+            # on its amount
+            change_script = bytes(change_script)
+            self._change = [change_script, 0,
+                            String(change_script).to_bytes()]
+            change = total - needed - self.fee(fee_per_kb)
+            if change > dust:
+                self._change[1] = change
+            else:
+                self._change = None
+        fee = total - needed
+        if self._change is not None:
+            fee -= self._change[1]
+        return fee
+
+    # Output
+    def _check_funded(self):
+        """ Refuses to emit a transaction paying out more than its inputs """
+        if not self._inputs:
+            return
+        out = self.total_out
+        if self._change is not None:
+            out += self._change[1]
+        if out > self.total_in:
+            raise InsufficientFunds(out, self.total_in)
+
+    def to_bytes(self):
+        """ Serializes the unsigned transaction in a single pass """
+        self._check_funded()
+        pack = struct.pack
+        empty_script = b'\x00'
+        seqno = pack("<L", self.seqno)
+        parts = [pack("<L", self.version), Int(len(self._inputs)).to_bytes()]
+        for txid, idx, _ in self._sorted_inputs():
+            parts.append(txid)
+            parts.append(pack("<L", idx))
+            parts.append(empty_script)
+            parts.append(seqno)
+        parts.append(Int(len(self)).to_bytes())
+        for amount, _, encoded in self._sorted_outputs():
+            parts.append(pack("<Q", amount))
+            parts.append(encoded)
+        parts.append(pack("<L", self.locktime))
+        return b''.join(parts)
+
+    def build(self):
+        """ Returns the unsigned transaction as a `transaction_class`
+        object """
+        self._check_funded()
+        tx = self.transaction_class()
+        tx.version = self.version
+        tx.locktime = self.locktime
+        for txid, idx, _ in self._sorted_inputs():
+            inpt = Input()
+            inpt.prevout_hash = Hash.from_internal_bo(txid)
+            inpt.prevout_idx = idx
+            inpt.seqno = self.seqno
+            tx.inputs.append(inpt)
+        for amount, script, _ in self._sorted_outputs():
+            output = Output()
+            output.amount = amount
+            output.script_sig = String(script)
+            tx.outputs.append(output)
+        return tx
@@ -0,0 +1,153 @@
+import struct
+
+from hashlib import sha256
+
+from .encoding import Int, String
+
+SIGHASH_ALL = 1
+SIGHASH_NONE = 2
+SIGHASH_SINGLE = 3
+SIGHASH_ANYONECANPAY = 0x80
+
+# Hash "signed" by SIGHASH_SINGLE when there's no output matching the input,
+# a long standing bitcoind quirk that has to be reproduced
+SIGHASH_SINGLE_BUG = b'\x01' + b'\x00' * 31
+
+_BLANK_OUTPUT = b'\xff' * 8 + b'\x00'
+
+
+class SignatureHasher(object):
+    """ Computes legacy (pre-segwit) signature hashes for every input of a
+    transaction without copying and re-serializing it per input.
+
+    The transaction is serialized once up front with blank input scripts.
+    For SIGHASH_ALL the SHA256 state over the shared prefix (version and the
+    inputs before the one being signed) is built incrementally and reused via
+    `copy()`, while the suffix is hashed straight out of the shared buffer.
+    Results are cached per (input index, script code, hashtype).
+
+    `script_code` is used as given, so any OP_CODESEPARATOR handling has to
+    be done by the caller. The hasher snapshots `tx` when created and won't
+    see later changes to it.
+
+    Example usage::
+
+        >>> hasher = tx.signature_hasher()
+        >>> hashes = hasher.sighashes(prev_scripts)
+    """
+
+    def __init__(self, tx):
+        pack = struct.pack
+        self.version = pack("<L", tx.version)
+        self.locktime = pack("<L", tx.locktime)
+        self.input_count = len(tx.inputs)
+        # (outpoint, seqno) for each input
+        self._inputs = [(inpt.prevout_hash.internal_bo +
+                         pack("<L", inpt.prevout_idx),
+                         pack("<L", inpt.seqno))
+                        for inpt in tx.inputs]
+        self._outputs = [pack("<Q", output.amount) +
+                         String(output.script_sig).to_bytes()
+                         for output in tx.outputs]
+
+        # Version, inputs with blank scripts, outputs and locktime in a single
+        # buffer, with the offset each input starts at
+        parts = [self.version, Int(self.input_count).to_bytes()]
+        self._offsets = []
+        offset = sum(len(p) for p in parts)
+        for outpoint, seqno in self._inputs:
+            self._offsets.append(offset)
+            blank = outpoint + b'\x00' + seqno
+            parts.append(blank)
+            offset += len(blank)
+        self._offsets.append(offset)
+        parts.append(Int(len(self._outputs)).to_bytes())
+        parts.extend(self._outputs)
+        parts.append(self.locktime)
+        self._blob = memoryview(b''.join(parts))
+
+        self._prefix_states = [sha256(self._blob[:self._offsets[0]])] \
+            if self._inputs else []
+        self._cache = {}
+
+    def _prefix_state(self, idx):
+        states = self._prefix_states
+        offsets = self._offsets
+        while len(states) <= idx:
+            i = len(states) - 1
+            state = states[-1].copy()
+            state.update(self._blob[offsets[i]:offsets[i + 1]])
+            states.append(state)
+        return states[idx].copy()
+
+    def _signed_input(self, idx, script_code, seqno=None):
+        outpoint, own_seqno = self._inputs[idx]
+        return outpoint + String(script_code).to_bytes() + \
+            (own_seqno if seqno is None else seqno)
+
+    def _message(self, idx, script_code, hashtype):
+        """ Serializes the modified transaction for hashtypes other than a
+        plain SIGHASH_ALL """
+        base = hashtype & 0x1f
+        zero_seqno = b'\x00' * 4
+        parts = [self.version]
+        if hashtype & SIGHASH_ANYONECANPAY:
+            parts.append(Int(1).to_bytes())
+            parts.append(self._signed_input(idx, script_code))
+        else:
+            parts.append(Int(self.input_count).to_bytes())
+            for i, (outpoint, seqno) in enumerate(self._inputs):
+                if i == idx:
+                    parts.append(self._signed_input(idx, script_code))
+                    continue
+                if base in (SIGHASH_NONE, SIGHASH_SINGLE):
+                    seqno = zero_seqno
+                parts.append(outpoint + b'\x00' + seqno)
+
+        if base == SIGHASH_NONE:
+            parts.append(Int(0).to_bytes())
+        elif base == SIGHASH_SINGLE:
+            parts.append(Int(idx + 1).to_bytes())
+            parts.extend([_BLANK_OUTPUT] * idx)
+            parts.append(self._outputs[idx])
+        else:
+            parts.append(Int(len(self._outputs)).to_bytes())
+            parts.extend(self._outputs)
+        parts.append(self.locktime)
+        return sha256(b''.join(parts))
+
+    def sighash(self, idx, script_code, hashtype=SIGHASH_ALL):
+        """ The double SHA256 digest signed for input `idx` spending an output
+        locked by `script_code` """
+        key = (idx, bytes(script_code), hashtype)
+        ret = self._cache.get(key)
+        if ret is not None:
+            return ret
+
+        if not 0 <= idx < self.input_count:
+            raise IndexError("Input index out of range")
+        base = hashtype & 0x1f
+        if base == SIGHASH_SINGLE and idx >= len(self._outputs):
+            ret = SIGHASH_SINGLE_BUG
+        else:
+            if base in (SIGHASH_NONE, SIGHASH_SINGLE) or \
+                    hashtype & SIGHASH_ANYONECANPAY:
+                state = self._message(idx, script_code, hashtype)
+            else:
+                state = self._prefix_state(idx)
+                state.update(self._signed_input(idx, script_code))
+                state.update(self._blob[self._offsets[idx + 1]:])
+            state.update(struct.pack("<L", hashtype))
+            ret = sha256(state.digest()).digest()
+        self._cache[key] = ret
+        return ret
+
+    def sighashes(self, script_codes, hashtype=SIGHASH_ALL):
+        """ Signature hashes for every input. `script_codes` is either one
+        script per input or a single script shared by all of them. """
+        if isinstance(script_codes, bytes):
+            script_codes = [script_codes] * self.input_count
+        if len(script_codes) != self.input_count:
+            raise ValueError("Need a script code for every input")
+        return [self.sighash(i, script_code, hashtype)
+                for i, script_code in enumerate(script_codes)]
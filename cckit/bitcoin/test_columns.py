@@ -0,0 +1,92 @@
+import base64
+import struct
+import pytest
+
+from io import BytesIO
+
+from .generic import Transaction
+from .payout import PayoutBuilder
+from .test_generic import transaction_tests
+from . import columns
+
+
+def sample_buffer():
+    raw = [base64.b64decode(b64tx) for b64tx, _ in transaction_tests]
+    # Enough outputs for a three byte output count, with large amounts
+    builder = PayoutBuilder(locktime=500000)
+    builder.extend((struct.pack("<H", i), 2 ** 40 + i) for i in range(300))
+    builder.add_input(b'\x05' * 32, 1, 2 ** 50)
+    raw.append(builder.to_bytes())
+    return b''.join(raw)
+
+
+def expected_columns(buf):
+    stream = BytesIO(buf)
+    txs = []
+    while stream.tell() < len(buf):
+        txs.append(Transaction.from_network(stream))
+    return dict(
+        version=[tx.version for tx in txs],
+        locktime=[tx.locktime for tx in txs],
+        input_count=[len(tx.inputs) for tx in txs],
+        output_count=[len(tx.outputs) for tx in txs],
+        amount=[o.amount for tx in txs for o in tx.outputs],
+        output_tx=[i for i, tx in enumerate(txs) for o in tx.outputs])
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_decode_columns(use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    buf = sample_buffer()
+    frame = columns.frame_transactions(buf)
+    assert len(frame) == len(transaction_tests) + 1
+    decoded = columns.decode_columns(buf, frame, use_numpy=use_numpy)
+    expected = expected_columns(buf)
+    assert sorted(decoded) == sorted(expected)
+    for name, values in expected.items():
+        assert list(decoded[name]) == values
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_empty_buffer(use_numpy):
+    if use_numpy:
+        pytest.importorskip("numpy")
+    frame = columns.frame_transactions(b'')
+    assert len(frame) == 0
+    decoded = columns.decode_columns(b'', frame, use_numpy=use_numpy)
+    assert sorted(decoded) == sorted(columns.COLUMNS)
+    for values in decoded.values():
+        assert len(values) == 0
+
+
+def test_frame_block():
+    txs = sample_buffer()
+    count = len(transaction_tests) + 1
+    block = b'\x00' * columns.BLOCK_HEADER_SIZE + struct.pack("<B", count)
+    frame = columns.frame_block(block + txs)
+    assert len(frame) == count
+    assert frame.tx_offsets[0] == columns.BLOCK_HEADER_SIZE + 1
+    assert frame.tx_ends[-1] == len(block + txs)
+
+
+def test_segwit_rejected():
+    legacy = base64.b64decode(transaction_tests[1][0])
+    # Same transaction with a segwit marker, flag and an empty witness
+    segwit = legacy[:4] + b'\x00\x01' + legacy[4:-4] + b'\x00' + legacy[-4:]
+    with pytest.raises(Exception) as excinfo:
+        columns.frame_transactions(legacy + segwit + legacy)
+    assert "Transaction 1" in str(excinfo.value)
+
+
+def test_truncated():
+    buf = sample_buffer()
+    with pytest.raises(Exception):
+        columns.frame_transactions(buf[:-2])
+
+
+def test_unknown_column():
+    buf = sample_buffer()
+    with pytest.raises(ValueError):
+        columns.decode_columns(buf, columns.frame_transactions(buf),
+                               columns=['fee'])
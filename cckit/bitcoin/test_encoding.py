@@ -23,6 +23,13 @@ def test_int_encode(encoded, decoded):
     assert int_obj.to_bytes() == encoded
 
 
+@pytest.mark.parametrize("encoded,decoded", int_tests)
+def test_varint_from_buffer(encoded, decoded):
+    buf = b'\x00' + encoded
+    assert encoding.varint_from_buffer(buf, 1) == (decoded, len(buf))
+    assert encoding.varint_size(decoded) == len(encoded)
+
+
 string_tests = [
     (b'\x0bthisisatest', b'thisisatest'),
 ]
@@ -0,0 +1,141 @@
+import pytest
+
+from io import BytesIO
+
+from .generic import Transaction
+from . import payout
+
+
+def p2pkh(n):
+    return b'\x76\xa9\x14' + bytes(bytearray([n])) * 20 + b'\x88\xac'
+
+
+def test_running_size_matches_serialization():
+    builder = payout.PayoutBuilder()
+    builder.extend((p2pkh(i % 150), 1000 + i) for i in range(300))
+    builder.remove(p2pkh(5))
+    builder.subtract(p2pkh(6), 1006 + 1156)
+    builder.add_input(b'\x01' * 32, 0, 10 ** 8)
+    raw = builder.to_bytes()
+    # Unsigned inputs carry an empty script_sig
+    assert builder.size == len(raw) + payout.P2PKH_SCRIPT_SIG_SIZE
+    assert len(builder) == 148
+
+
+def test_merge_and_ordering():
+    builder = payout.PayoutBuilder()
+    builder.extend([(p2pkh(2), 500), (p2pkh(1), 700), (p2pkh(2), 300),
+                    (p2pkh(3), 500)])
+    tx = builder.build()
+    assert [(o.amount, o.script_sig) for o in tx.outputs] == [
+        (500, p2pkh(3)), (700, p2pkh(1)), (800, p2pkh(2))]
+    assert builder.total_out == 2000
+
+    f = BytesIO()
+    tx.to_network(f)
+    assert f.getvalue() == builder.to_bytes()
+    parsed = Transaction.from_network(BytesIO(builder.to_bytes()))
+    assert len(parsed.outputs) == 3
+
+
+def test_select_coins_with_change():
+    builder = payout.PayoutBuilder()
+    builder.add(p2pkh(1), 50000)
+    utxos = [(b'\x02' * 32, 0, 30000), (b'\x03' * 32, 1, 40000),
+             (b'\x04' * 32, 0, 1000)]
+    fee = builder.select_coins(utxos, fee_per_kb=10000,
+                               change_script=p2pkh(9))
+    assert [i[2] for i in builder._inputs] == [40000, 30000]
+    assert fee == builder.fee(10000)
+    assert builder.change == (p2pkh(9), 70000 - 50000 - fee)
+    assert len(builder) == 2
+    raw = builder.to_bytes()
+    assert builder.size == len(raw) + 2 * payout.P2PKH_SCRIPT_SIG_SIZE
+    assert len(builder.build().outputs) == 2
+
+    # Reselecting replaces the previous inputs and change
+    fee = builder.select_coins(utxos, fee_per_kb=0, change_script=p2pkh(9))
+    assert fee == 0
+    assert builder.change == (p2pkh(9), 20000)
+    assert builder.total_out == 50000
+
+
+def test_change_to_payee_script():
+    builder = payout.PayoutBuilder()
+    builder.add(p2pkh(1), 50000)
+    builder.add(p2pkh(2), 5000)
+    utxos = [(b'\x02' * 32, 0, 70000)]
+    builder.select_coins(utxos, fee_per_kb=0, change_script=p2pkh(2))
+    # The payee and the change stay separate outputs
+    assert builder.amount(p2pkh(2)) == 5000
+    assert builder.change == (p2pkh(2), 15000)
+    assert len(builder) == 3
+
+    # Dropping the payee doesn't disturb a later reselection
+    builder.remove(p2pkh(2))
+    fee = builder.select_coins(utxos, fee_per_kb=0, change_script=p2pkh(2))
+    assert fee == 0
+    assert builder.change == (p2pkh(2), 20000)
+    assert len(builder) == 2
+
+
+def test_select_coins_no_outputs():
+    builder = payout.PayoutBuilder()
+    with pytest.raises(ValueError):
+        builder.select_coins([(b'\x02' * 32, 0, 1000)], fee_per_kb=0)
+
+
+def test_select_coins_dust_left_as_fee():
+    builder = payout.PayoutBuilder()
+    builder.add(p2pkh(1), 10000)
+    fee = builder.select_coins([(b'\x02' * 32, 0, 12500)], fee_per_kb=10000,
+                               change_script=p2pkh(9))
+    assert len(builder) == 1
+    assert builder.change is None
+    assert fee == 2500
+
+
+def test_insufficient_funds():
+    builder = payout.PayoutBuilder()
+    builder.add(p2pkh(1), 10000)
+    with pytest.raises(payout.InsufficientFunds):
+        builder.select_coins([(b'\x02' * 32, 0, 10000)], fee_per_kb=1000)
+
+
+def test_output_change_drops_selection():
+    builder = payout.PayoutBuilder()
+    builder.add(p2pkh(1), 50000)
+    utxos = [(b'\x02' * 32, 0, 100000)]
+    builder.select_coins(utxos, fee_per_kb=10000, change_script=p2pkh(9))
+    assert builder.change is not None
+
+    builder.add(p2pkh(2), 40000)
+    assert builder.change is None
+    assert builder.total_in == 0
+    fee = builder.select_coins(utxos, fee_per_kb=10000,
+                               change_script=p2pkh(9))
+    assert builder.total_out + builder.change[1] + fee == 100000
+
+    builder.subtract(p2pkh(1), 1000)
+    assert builder.change is None
+    assert builder.total_in == 0
+
+
+def test_refuses_underfunded():
+    builder = payout.PayoutBuilder()
+    builder.add(p2pkh(1), 50000)
+    builder.add_input(b'\x02' * 32, 0, 40000)
+    with pytest.raises(payout.InsufficientFunds):
+        builder.to_bytes()
+    with pytest.raises(payout.InsufficientFunds):
+        builder.build()
+
+
+def test_subtract_rejects_non_positive():
+    builder = payout.PayoutBuilder()
+    builder.add(p2pkh(1), 50000)
+    with pytest.raises(ValueError):
+        builder.subtract(p2pkh(1), -5)
+    with pytest.raises(ValueError):
+        builder.subtract(p2pkh(1), 0)
+    assert builder.amount(p2pkh(1)) == 50000
@@ -0,0 +1,101 @@
+import copy
+import base64
+import struct
+import pytest
+
+from hashlib import sha256
+from io import BytesIO
+
+from .generic import Transaction
+from .encoding import String
+from . import sighash
+
+# Three inputs, three outputs
+tx_b64 = (
+    "AQAAAAO1CFlm1mEB3fjCtilQEH+6TbR3UzdJyqafj3mab9Mc6gAAAACKRzBE"
+    "AiA8rWZ4BB8YYJp3xtx8jAZdrfQ6B0zjYRdgTS7I5LZF7gIgabCjn9iu9L3n"
+    "YvKrdXFJJygtbg6V8iMTLrPh8ghdGvwBQQQrFyHfSwwc/dYBDTAplV8URGSP"
+    "hOkDkpE6FU7Z8u7YjiYZh8v43IuCs0JrnL1AaLbCua+AosI4YzpAAF0Q+klg"
+    "/////8IGRKg0Yc6dSC1wLLwjzs4N0yZbVYvnoY004ha9pxwAAQAAAItIMEUC"
+    "IDNZYWLuCV0nJL6CCGgUfQfNoh0oAACd2lMZn+zJdJCDAiEAqZafa18G1K1x"
+    "/6yOvj8h1uAGSM8UjSJJ6479li5sos4BQQTswrqYR5m+x0vFTzgGrrM2k+Gx"
+    "gX+hDBAvN8Kq9RRuWdqC4jVNGhGdFD63Ev1TQYXMqvp6b9ztbAZ3ED8i6sFo"
+    "/////0Vf19DzvUs2DvFwlVW9viTF+YlXCNYNMD6yUXK9I9RBAgAAAItIMEUC"
+    "IQCKbaQY2eH1fsXZFksstrP4B+uxPBwGRe2Wxl7rW5sYGwIgVvVEPdnJNvVj"
+    "rh0XZdhqnOAA0Sw39Upqkejrm+yXWnwBQQQ1hDJBuzoTc1ZJ8zyVQjEfRcjW"
+    "o8rq3lE+3x3rYZ3Q/9xBEBtsnkFAzps/N8n6C5cK2QAmRGxeGFmbYaGFT5RP"
+    "/////wNAQg8AAAAAABl2qRSU70Qwi2d2bI+nKnCP19XGsbSnWoisVEkwAAAA"
+    "AAAZdqkUgroT7ai54LzKPXVnWJsPoV6lJ0yIrHjrFQAAAAAAGXapFEFyZV9I"
+    "izJXnWmTivO2n9OKDWCdiKwAAAAA")
+
+
+def parse():
+    return Transaction.from_network(BytesIO(base64.b64decode(tx_b64)))
+
+
+def reference_sighash(tx, idx, script_code, hashtype):
+    """ Straight port of bitcoind's original SignatureHash """
+    tx = copy.deepcopy(tx)
+    base = hashtype & 0x1f
+    for inpt in tx.inputs:
+        inpt.script_sig = String()
+    tx.inputs[idx].script_sig = String(script_code)
+    if base == sighash.SIGHASH_NONE:
+        tx.outputs = []
+    elif base == sighash.SIGHASH_SINGLE:
+        if idx >= len(tx.outputs):
+            return sighash.SIGHASH_SINGLE_BUG
+        tx.outputs = tx.outputs[:idx + 1]
+        for output in tx.outputs[:idx]:
+            output.amount = 0xffffffffffffffff
+            output.script_sig = String()
+    if base in (sighash.SIGHASH_NONE, sighash.SIGHASH_SINGLE):
+        for i, inpt in enumerate(tx.inputs):
+            if i != idx:
+                inpt.seqno = 0
+    if hashtype & sighash.SIGHASH_ANYONECANPAY:
+        tx.inputs = [tx.inputs[idx]]
+    f = BytesIO()
+    tx.to_network(f)
+    f.write(struct.pack("<L", hashtype))
+    return sha256(sha256(f.getvalue()).digest()).digest()
+
+
+hashtypes = [sighash.SIGHASH_ALL, sighash.SIGHASH_NONE, sighash.SIGHASH_SINGLE]
+hashtypes += [h | sighash.SIGHASH_ANYONECANPAY for h in hashtypes]
+
+
+@pytest.mark.parametrize("hashtype", hashtypes)
+def test_matches_reference(hashtype):
+    tx = parse()
+    script = b'\x76\xa9\x14' + b'\x11' * 20 + b'\x88\xac'
+    hasher = tx.signature_hasher()
+    expected = [reference_sighash(tx, i, script, hashtype)
+                for i in range(len(tx.inputs))]
+    assert hasher.sighashes(script, hashtype) == expected
+    # Out of order lookups on a fresh hasher exercise the prefix states
+    # being built ahead of use and reused from the cache
+    hasher = sighash.SignatureHasher(tx)
+    for idx in (2, 0, 1):
+        assert hasher.sighash(idx, script, hashtype) == expected[idx]
+
+
+def test_single_bug():
+    tx = parse()
+    tx.outputs = tx.outputs[:1]
+    hasher = sighash.SignatureHasher(tx)
+    assert hasher.sighash(2, b'', sighash.SIGHASH_SINGLE) == \
+        sighash.SIGHASH_SINGLE_BUG
+
+
+def test_script_per_input():
+    tx = parse()
+    scripts = [b'\x51', b'\x52\x53', b'']
+    hasher = tx.signature_hasher()
+    assert hasher.sighashes(scripts) == [
+        reference_sighash(tx, i, s, sighash.SIGHASH_ALL)
+        for i, s in enumerate(scripts)]
+    with pytest.raises(ValueError):
+        hasher.sighashes(scripts[:2])
+    with pytest.raises(IndexError):
+        hasher.sighash(3, b'')
@@ -0,0 +1,202 @@
+import pytest
+
+from .generic import Transaction, Input, Output
+from .encoding import Hash, String
+from . import utxo
+
+
+def make_tx(spends, outputs):
+    tx = Transaction()
+    for txid, idx in spends:
+        inpt = Input()
+        inpt.prevout_hash = Hash.from_internal_bo(txid)
+        inpt.prevout_idx = idx
+        inpt.seqno = 0xffffffff
+        tx.inputs.append(inpt)
+    for amount, script in outputs:
+        output = Output()
+        output.amount = amount
+        output.script_sig = String(script)
+        tx.outputs.append(output)
+    return tx
+
+
+def coinbase(amount, script, nonce):
+    tx = make_tx([(utxo.COINBASE_TXID, 0xffffffff)], [(amount, script)])
+    tx.inputs[0].script_sig = String(nonce)
+    return tx
+
+
+def test_apply_and_balance():
+    utxos = utxo.UTXOSet()
+    cb = coinbase(50, b'alice', b'\x01')
+    cb_id = utxo.transaction_hash(cb)
+    spend = make_tx([(cb_id, 0)], [(30, b'bob'), (20, b'alice')])
+    spend_id = utxo.transaction_hash(spend)
+    utxos.apply_block([cb, spend])
+
+    assert len(utxos) == 2
+    assert (cb_id, 0) not in utxos
+    assert utxos.get(spend_id, 0) == (30, b'bob')
+    assert utxos.balance(b'alice') == 20
+    assert utxos.balance(b'bob') == 30
+    assert utxos.balance(b'carol') == 0
+    assert sorted(utxos.balances()) == [(b'alice', 20, 1), (b'bob', 30, 1)]
+
+
+def test_double_spend_rolls_back():
+    utxos = utxo.UTXOSet()
+    cb = coinbase(50, b'alice', b'\x01')
+    cb_id = utxo.transaction_hash(cb)
+    utxos.apply_block([cb])
+    first = make_tx([(cb_id, 0)], [(50, b'bob')])
+    second = make_tx([(cb_id, 0)], [(50, b'carol')])
+    with pytest.raises(utxo.UTXOError):
+        utxos.apply_block([first, second])
+    assert utxos.get(cb_id, 0) == (50, b'alice')
+    assert len(utxos) == 1
+    assert utxos.balance(b'bob') == 0
+
+
+def test_undo_block():
+    utxos = utxo.UTXOSet()
+    cb = coinbase(50, b'alice', b'\x01')
+    cb_id = utxo.transaction_hash(cb)
+    utxos.apply_block([cb])
+    before = sorted(utxos)
+    undo = utxos.apply_block([
+        coinbase(50, b'bob', b'\x02'),
+        make_tx([(cb_id, 0)], [(10, b'carol'), (40, b'alice')])])
+    utxos.undo_block(undo)
+    assert sorted(utxos) == before
+    assert utxos.balance(b'alice') == 50
+    assert utxos.balance(b'carol') == 0
+
+
+def test_undo_replaced_outpoint():
+    utxos = utxo.UTXOSet()
+    cb = coinbase(50, b'alice', b'\x01')
+    utxos.apply_block([cb])
+    # A duplicate coinbase overwrites the original outpoint
+    undo = utxos.apply_block([coinbase(50, b'alice', b'\x01')])
+    assert len(utxos) == 1
+    utxos.undo_block(undo)
+    assert utxos.get(utxo.transaction_hash(cb), 0) == (50, b'alice')
+    assert utxos.balance(b'alice') == 50
+
+
+def test_resize_and_delete():
+    utxos = utxo.UTXOSet()
+    txids = [utxo.transaction_hash(coinbase(1, b's', bytes(bytearray([i]))))
+             for i in range(256)]
+    scripts = [b'script0', b'script1', b'script2']
+    for txid in txids:
+        for idx in range(10):
+            utxos.add(txid, idx, idx, scripts[idx % 3])
+    assert len(utxos) == 2560
+    for txid in txids[::2]:
+        for idx in range(10):
+            utxos.spend(txid, idx)
+    assert len(utxos) == 1280
+    for txid in txids[1::2]:
+        for idx in range(10):
+            assert utxos.get(txid, idx) == (idx, scripts[idx % 3])
+    assert utxos.balance(b'script0') == 128 * (0 + 3 + 6 + 9)
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_snapshot(tmpdir, use_mmap):
+    utxos = utxo.UTXOSet()
+    cb = coinbase(50, b'alice', b'\x01')
+    cb_id = utxo.transaction_hash(cb)
+    utxos.apply_block([cb, coinbase(25, b'bob', b'\x02')])
+    path = str(tmpdir.join("utxo.snap"))
+    utxos.save(path)
+
+    loaded = utxo.UTXOSet.load(path, use_mmap=use_mmap)
+    assert sorted(loaded) == sorted(utxos)
+    assert loaded.balance(b'bob') == 25
+    loaded.apply_block([make_tx([(cb_id, 0)], [(50, b'carol')])])
+    assert loaded.balance(b'carol') == 50
+    assert utxo.UTXOSet.load(path).balance(b'alice') == 50
+
+
+def test_snapshot_save_over_mapped(tmpdir):
+    utxos = utxo.UTXOSet()
+    cb = coinbase(50, b'alice', b'\x01')
+    cb_id = utxo.transaction_hash(cb)
+    utxos.apply_block([cb])
+    path = str(tmpdir.join("utxo.snap"))
+    utxos.save(path)
+
+    loaded = utxo.UTXOSet.load(path, use_mmap=True)
+    loaded.apply_block([make_tx([(cb_id, 0)], [(20, b'bob'), (30, b'carol')]),
+                        coinbase(25, b'dave', b'\x02')])
+    loaded.save(path)
+    # The old mapping stays readable after the file is replaced
+    assert loaded.balance(b'carol') == 30
+    assert sorted(loaded) == sorted(utxo.UTXOSet.load(path))
+
+    reloaded = utxo.UTXOSet.load(path)
+    assert len(reloaded) == 3
+    assert reloaded.get(cb_id, 0) is None
+    assert reloaded.balance(b'bob') == 20
+    assert reloaded.balance(b'dave') == 25
+    assert tmpdir.listdir() == [tmpdir.join("utxo.snap")]
+
+
+def test_compact_scripts():
+    utxos = utxo.UTXOSet()
+    txid = b'\x07' * 32
+    for idx in range(10):
+        utxos.add(txid, idx, 5, b'script' + str(idx).encode())
+    for idx in range(9):
+        utxos.spend(txid, idx)
+    blob_len = len(utxos._script_blob)
+    utxos.compact_scripts()
+    assert len(utxos._script_counts) == 1
+    assert len(utxos._script_blob) < blob_len
+    assert utxos.get(txid, 9) == (5, b'script9')
+    assert utxos.balance(b'script9') == 5
+    assert utxos.balance(b'script0') == 0
+    # Dead scripts can be interned again afterwards
+    utxos.add(txid, 0, 7, b'script0')
+    assert utxos.balance(b'script0') == 7
+
+
+def test_snapshot_drops_spent_scripts(tmpdir):
+    utxos = utxo.UTXOSet()
+    txid = b'\x07' * 32
+    for idx in range(10):
+        utxos.add(txid, idx, 5, b'script' + str(idx).encode())
+    for idx in range(1, 10):
+        utxos.spend(txid, idx)
+    path = str(tmpdir.join("utxo.snap"))
+    utxos.save(path)
+    loaded = utxo.UTXOSet.load(path)
+    assert len(loaded._script_counts) == 1
+    assert list(loaded.balances()) == [(b'script0', 5, 1)]
+
+
+def test_compacts_automatically():
+    utxos = utxo.UTXOSet()
+    txids = [utxo.transaction_hash(coinbase(1, b's', str(i).encode()))
+             for i in range(3000)]
+    for i, txid in enumerate(txids):
+        utxos.add(txid, 0, i, b'script' + str(i).encode())
+    for txid in txids[10:]:
+        utxos.spend(txid, 0)
+    assert len(utxos._script_counts) < 1500
+    assert len(utxos) == 10
+    for i, txid in enumerate(txids[:10]):
+        assert utxos.get(txid, 0) == (i, b'script' + str(i).encode())
+
+
+def test_reserve():
+    utxos = utxo.UTXOSet(capacity=10000)
+    capacity = utxos._capacity
+    assert capacity * 3 >= 10000 * 4
+    utxos.reserve(5000)
+    assert utxos._capacity == capacity
+    utxos.reserve(100000)
+    assert utxos._capacity * 3 >= 100000 * 4
@@ -0,0 +1,472 @@
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+from array import array
+from hashlib import sha256
+from io import BytesIO
+
+from .encoding import array_from_bytes, array_to_bytes, uint64_typecode
+
+# Outpoint slot layout: txid (internal byte order), output index, amount and
+# script id + 1. A script id of zero marks an empty slot.
+_slot = struct.Struct("<32sLQL")
+SLOT_SIZE = _slot.size
+_SID_OFFSET = struct.calcsize("<32sLQ")
+_EMPTY_SLOT = b'\x00' * SLOT_SIZE
+
+_header = struct.Struct("<8sQQQQQ")
+SNAPSHOT_MAGIC = b'CCKUTXO1'
+_SAVE_CHUNK = SLOT_SIZE * 65536
+
+COINBASE_TXID = b'\x00' * 32
+_GOLDEN = 0x9E3779B97F4A7C15
+_MIN_CAPACITY = 1024
+
+
+class UTXOError(Exception):
+    """ Raised when a transaction spends an outpoint that isn't in the set """
+    def __init__(self, txid, idx):
+        self.txid = txid
+        self.idx = idx
+        super(UTXOError, self).__init__(
+            "Outpoint {}:{} not in UTXO set".format(
+                _rpc_hex(txid), idx))
+
+
+def _rpc_hex(txid):
+    ba = bytearray(txid)
+    ba.reverse()
+    return "".join("{:02x}".format(b) for b in ba)
+
+
+def _txid_bytes(txid):
+    """ Accept either raw internal byte order bytes or a `Hash` object """
+    if isinstance(txid, bytes):
+        return txid
+    return txid.internal_bo
+
+
+def transaction_hash(tx):
+    """ Double SHA256 of the network serialization of `tx`, in internal byte
+    order. """
+    f = BytesIO()
+    tx.to_network(f)
+    return sha256(sha256(f.getvalue()).digest()).digest()
+
+
+def _replace(src, dst):
+    """ `os.replace`, falling back to `os.rename` on Python 2 """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        os.rename(src, dst)
+
+
+def _slots_for(count):
+    """ Table size that holds `count` outputs under the 3/4 load limit """
+    return _power_of_two(count * 4 // 3 + 1)
+
+
+def _power_of_two(n):
+    cap = _MIN_CAPACITY
+    while cap < n:
+        cap <<= 1
+    return cap
+
+
+class UTXOSet(object):
+    """ An unspent transaction output set built by applying a stream of
+    `Transaction` objects.
+
+    Outpoints live in a linear probing hash table packed into a single
+    `bytearray` (or a copy-on-write memory map when loaded from a snapshot),
+    costing 48 bytes a slot. Scripts are interned into a shared blob so
+    repeated payout addresses are only stored once, and a running balance is
+    kept per script. Scripts left without unspent outputs are compacted away
+    once enough of them pile up, and always before a snapshot is written.
+
+    The table doubles when it passes 3/4 full. Growing holds the old and new
+    tables at once, so peaks at roughly 3x the final table size, and
+    re-inserts every output in Python. When the output count is roughly
+    known, size the table up front with `capacity` or `reserve`, e.g. 50
+    million outputs take 2^27 slots, about 6.4 GB.
+
+    Example usage::
+
+        >>> utxos = UTXOSet()
+        >>> undo = utxos.apply_block(block_transactions)
+        >>> utxos.balance(script_pub_key)
+        5000000000
+        >>> utxos.undo_block(undo)  # Reorg the block back out
+    """
+
+    def __init__(self, capacity=_MIN_CAPACITY):
+        """ `capacity` is the number of outputs to size the table for """
+        self._capacity = _slots_for(capacity)
+        # Slot table storage and the offset the table starts at within it
+        self._slots = bytearray(self._capacity * SLOT_SIZE)
+        self._base = 0
+        self._count = 0
+
+        self._script_blob = bytearray()
+        self._script_offsets = array(uint64_typecode, [0])
+        self._script_balances = array(uint64_typecode)
+        self._script_counts = array('I')
+        self._script_index = array('I', [0]) * _MIN_CAPACITY
+        # Number of interned scripts with no unspent outputs
+        self._dead_scripts = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, outpoint):
+        txid, idx = outpoint
+        return self._find(_txid_bytes(txid), idx)[1]
+
+    def __iter__(self):
+        """ Yields (txid, idx, amount, script) for every unspent output """
+        for pos in range(self._capacity):
+            txid, idx, amount, sid = _slot.unpack_from(
+                self._slots, self._base + pos * SLOT_SIZE)
+            if sid:
+                yield txid, idx, amount, self._script(sid - 1)
+
+    # Outpoint table
+    def _home(self, txid, idx):
+        h = struct.unpack_from("<Q", txid)[0] ^ ((idx + 1) * _GOLDEN)
+        return h & (self._capacity - 1)
+
+    def _find(self, txid, idx):
+        """ Returns the slot the outpoint occupies or should occupy, and
+        whether it was found. """
+        mask = self._capacity - 1
+        slots = self._slots
+        base = self._base
+        pos = self._home(txid, idx)
+        while True:
+            key_txid, key_idx, _, sid = _slot.unpack_from(
+                slots, base + pos * SLOT_SIZE)
+            if not sid:
+                return pos, False
+            if key_idx == idx and key_txid == txid:
+                return pos, True
+            pos = (pos + 1) & mask
+
+    def _resize(self, capacity):
+        old_slots = self._slots
+        old_base = self._base
+        old_capacity = self._capacity
+        self._capacity = capacity
+        self._slots = bytearray(capacity * SLOT_SIZE)
+        self._base = 0
+        for pos in range(old_capacity):
+            entry = _slot.unpack_from(old_slots, old_base + pos * SLOT_SIZE)
+            if entry[3]:
+                new_pos = self._find(entry[0], entry[1])[0]
+                _slot.pack_into(self._slots, new_pos * SLOT_SIZE, *entry)
+
+    def reserve(self, count):
+        """ Grows the table up front so it can hold `count` outputs without
+        resizing again """
+        capacity = _slots_for(count)
+        if capacity > self._capacity:
+            self._resize(capacity)
+
+    def _delete_at(self, pos):
+        """ Backward shift deletion, keeps probe chains intact without
+        tombstones. """
+        mask = self._capacity - 1
+        slots = self._slots
+        base = self._base
+        hole = pos
+        cur = pos
+        while True:
+            cur = (cur + 1) & mask
+            txid, idx, _, sid = _slot.unpack_from(
+                slots, base + cur * SLOT_SIZE)
+            if not sid:
+                break
+            home = self._home(txid, idx)
+            # Entry can stay put if its home lies cyclically in (hole, cur]
+            if hole <= cur:
+                if hole < home <= cur:
+                    continue
+            elif home > hole or home <= cur:
+                continue
+            start = base + cur * SLOT_SIZE
+            dest = base + hole * SLOT_SIZE
+            slots[dest:dest + SLOT_SIZE] = slots[start:start + SLOT_SIZE]
+            hole = cur
+        dest = base + hole * SLOT_SIZE
+        slots[dest:dest + SLOT_SIZE] = _EMPTY_SLOT
+
+    def add(self, txid, idx, amount, script):
+        """ Adds a single unspent output. Re-adding an existing outpoint
+        replaces it, as bitcoind did for pre-BIP30 duplicate coinbases, and
+        returns the (amount, script) that was replaced, otherwise None. """
+        txid = _txid_bytes(txid)
+        if (self._count + 1) * 4 > self._capacity * 3:
+            self._resize(self._capacity * 2)
+        pos, found = self._find(txid, idx)
+        replaced = None
+        if found:
+            old_amount, old_sid = self._unlink(pos)
+            replaced = old_amount, self._script(old_sid)
+        else:
+            self._count += 1
+        sid = self._intern(script)
+        if not self._script_counts[sid]:
+            self._dead_scripts -= 1
+        self._script_balances[sid] += amount
+        self._script_counts[sid] += 1
+        _slot.pack_into(self._slots, self._base + pos * SLOT_SIZE,
+                        txid, idx, amount, sid + 1)
+        return replaced
+
+    def get(self, txid, idx):
+        """ Returns (amount, script) for an unspent output, or None """
+        txid = _txid_bytes(txid)
+        pos, found = self._find(txid, idx)
+        if not found:
+            return None
+        _, _, amount, sid = _slot.unpack_from(
+            self._slots, self._base + pos * SLOT_SIZE)
+        return amount, self._script(sid - 1)
+
+    def spend(self, txid, idx):
+        """ Removes an output from the set, returning (amount, script). Raises
+        `UTXOError` if it isn't unspent. """
+        txid = _txid_bytes(txid)
+        pos, found = self._find(txid, idx)
+        if not found:
+            raise UTXOError(txid, idx)
+        amount, sid = self._unlink(pos)
+        self._delete_at(pos)
+        self._count -= 1
+        script = self._script(sid)
+        # Compacting rewrites every slot, so wait until the dead scripts
+        # outnumber the live ones and enough spends have happened to pay
+        # for it
+        dead = self._dead_scripts
+        if dead > _MIN_CAPACITY and dead * 2 > len(self._script_counts) and \
+                dead * 2 > self._count:
+            self.compact_scripts()
+        return amount, script
+
+    def _unlink(self, pos):
+        _, _, amount, sid = _slot.unpack_from(
+            self._slots, self._base + pos * SLOT_SIZE)
+        sid -= 1
+        self._script_balances[sid] -= amount
+        self._script_counts[sid] -= 1
+        if not self._script_counts[sid]:
+            self._dead_scripts += 1
+        return amount, sid
+
+    # Script table
+    def _script(self, sid):
+        offsets = self._script_offsets
+        return bytes(self._script_blob[offsets[sid]:offsets[sid + 1]])
+
+    def _script_lookup(self, script):
+        """ Returns the index table position for `script` and its id, or None
+        if it hasn't been interned. """
+        index = self._script_index
+        mask = len(index) - 1
+        pos = zlib.crc32(script) & mask
+        while True:
+            val = index[pos]
+            if not val:
+                return pos, None
+            if self._script(val - 1) == script:
+                return pos, val - 1
+            pos = (pos + 1) & mask
+
+    def _intern(self, script):
+        script = bytes(script)
+        pos, sid = self._script_lookup(script)
+        if sid is not None:
+            return sid
+        sid = len(self._script_balances)
+        self._script_blob += script
+        self._script_offsets.append(len(self._script_blob))
+        self._script_balances.append(0)
+        self._script_counts.append(0)
+        self._dead_scripts += 1
+        self._script_index[pos] = sid + 1
+        if (sid + 1) * 4 > len(self._script_index) * 3:
+            self._rebuild_script_index(len(self._script_index) * 2)
+        return sid
+
+    def _rebuild_script_index(self, capacity):
+        self._script_index = index = array('I', [0]) * capacity
+        mask = capacity - 1
+        for sid in range(len(self._script_balances)):
+            pos = zlib.crc32(self._script(sid)) & mask
+            while index[pos]:
+                pos = (pos + 1) & mask
+            index[pos] = sid + 1
+
+    def compact_scripts(self):
+        """ Drops scripts that no longer have unspent outputs from the
+        script table and renumbers the rest, rewriting the script id of every
+        slot """
+        if not self._dead_scripts:
+            return
+        offsets = self._script_offsets
+        remap = array('I', [0]) * len(self._script_counts)
+        blob = bytearray()
+        new_offsets = array(uint64_typecode, [0])
+        balances = array(uint64_typecode)
+        counts = array('I')
+        for sid, count in enumerate(self._script_counts):
+            if not count:
+                continue
+            blob += self._script_blob[offsets[sid]:offsets[sid + 1]]
+            new_offsets.append(len(blob))
+            balances.append(self._script_balances[sid])
+            counts.append(count)
+            remap[sid] = len(counts)
+
+        slots = self._slots
+        for pos in range(self._capacity):
+            off = self._base + pos * SLOT_SIZE + _SID_OFFSET
+            sid, = struct.unpack_from("<L", slots, off)
+            if sid:
+                struct.pack_into("<L", slots, off, remap[sid - 1])
+
+        self._script_blob = blob
+        self._script_offsets = new_offsets
+        self._script_balances = balances
+        self._script_counts = counts
+        self._dead_scripts = 0
+        self._rebuild_script_index(_power_of_two(len(counts) * 4 // 3 + 1))
+
+    def balance(self, script):
+        """ Total unspent amount paying to `script` """
+        sid = self._script_lookup(bytes(script))[1]
+        if sid is None:
+            return 0
+        return self._script_balances[sid]
+
+    def balances(self):
+        """ Yields (script, balance, output count) for every script that
+        currently has unspent outputs. """
+        for sid in range(len(self._script_balances)):
+            if self._script_counts[sid]:
+                yield (self._script(sid), self._script_balances[sid],
+                       self._script_counts[sid])
+
+    # Transaction application
+    def apply_transaction(self, tx, undo=None, txid=None):
+        """ Spends the inputs and adds the outputs of a single transaction.
+        Changes are appended to `undo` if given so they can be reverted with
+        `undo_block`. Undo entries are (txid, idx, created, restore): the
+        outpoint is spent again if `created`, then `restore` (an amount and
+        script) is put back if it isn't None. """
+        if txid is None:
+            txid = transaction_hash(tx)
+        for inpt in tx.inputs:
+            prev_txid = _txid_bytes(inpt.prevout_hash)
+            if prev_txid == COINBASE_TXID:
+                continue
+            amount, script = self.spend(prev_txid, inpt.prevout_idx)
+            if undo is not None:
+                undo.append((prev_txid, inpt.prevout_idx, False,
+                             (amount, script)))
+        for idx, output in enumerate(tx.outputs):
+            replaced = self.add(txid, idx, output.amount, output.script_sig)
+            if undo is not None:
+                undo.append((txid, idx, True, replaced))
+        return undo
+
+    def apply_block(self, transactions):
+        """ Applies an iterable of transactions in order and returns an undo
+        log for `undo_block`. If any transaction fails to apply the changes
+        made so far are reverted before the exception propagates. """
+        undo = []
+        try:
+            for tx in transactions:
+                self.apply_transaction(tx, undo)
+        except Exception:
+            self.undo_block(undo)
+            raise
+        return undo
+
+    def undo_block(self, undo):
+        """ Reverts the changes recorded by `apply_block` """
+        for txid, idx, created, restore in reversed(undo):
+            if created:
+                self.spend(txid, idx)
+            if restore is not None:
+                self.add(txid, idx, *restore)
+
+    # Snapshots
+    def save(self, path):
+        """ Writes the set to `path` in a format that `load` can memory map.
+        Arrays are written in native byte order.
+
+        The snapshot is written to a temporary file that's then renamed over
+        `path`, so a set loaded from `path` with `use_mmap` can be saved back
+        to it without truncating the file it's still mapped onto. Scripts
+        without unspent outputs are compacted away first. """
+        self.compact_scripts()
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_header.pack(
+                    SNAPSHOT_MAGIC, self._count, self._capacity,
+                    len(self._script_balances), len(self._script_blob),
+                    len(self._script_index)))
+                # Copied out in chunks rather than slicing the whole table
+                end = self._base + self._capacity * SLOT_SIZE
+                for start in range(self._base, end, _SAVE_CHUNK):
+                    f.write(self._slots[start:min(start + _SAVE_CHUNK, end)])
+                for arr in (self._script_offsets, self._script_balances,
+                            self._script_counts, self._script_index):
+                    f.write(array_to_bytes(arr))
+                f.write(self._script_blob)
+            _replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, use_mmap=True):
+        """ Loads a snapshot written by `save`. With `use_mmap` the outpoint
+        table is mapped copy-on-write, so it's paged in lazily and changes
+        never touch the file. """
+        self = cls.__new__(cls)
+        with open(path, 'rb') as f:
+            if use_mmap:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            else:
+                data = bytearray(f.read())
+        (magic, self._count, self._capacity, n_scripts, blob_len,
+         index_len) = _header.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise Exception("Not a UTXO snapshot")
+
+        # The slot table is used in place, the smaller script tables are
+        # copied out
+        self._slots = data
+        self._base = pos = _header.size
+        pos += self._capacity * SLOT_SIZE
+
+        def read_array(typecode, length):
+            arr = array(typecode)
+            end = pos + length * arr.itemsize
+            array_from_bytes(arr, data[pos:end])
+            return arr, end
+        self._script_offsets, pos = read_array(uint64_typecode, n_scripts + 1)
+        self._script_balances, pos = read_array(uint64_typecode, n_scripts)
+        self._script_counts, pos = read_array('I', n_scripts)
+        self._script_index, pos = read_array('I', index_len)
+        self._script_blob = bytearray(data[pos:pos + blob_len])
+        self._dead_scripts = sum(1 for count in self._script_counts
+                                 if not count)
+        return self
@@ -0,0 +1,235 @@
+import atexit
+import functools
+import json
+import sys
+import threading
+import time
+
+from .serialize import Streamer
+from .bitcoin import encoding, generic
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# How many bytes a call processed, based on the method name
+STREAM_METHODS = ('from_stream', 'to_stream', 'from_network', 'to_network',
+                  'from_ref_disk')
+INPUT_METHODS = ('from_bytes', 'from_hex', 'from_internal_bo', 'from_rpc_bo')
+OUTPUT_METHODS = ('to_bytes', 'to_hex')
+
+ENV_VAR = 'CCKIT_PROFILE'
+
+_active = None
+
+
+def _subclasses(cls):
+    for sub in cls.__subclasses__():
+        yield sub
+        for subsub in _subclasses(sub):
+            yield subsub
+
+
+def default_targets():
+    """ Every `Streamer` subclass along with the other codec classes that
+    don't inherit from it """
+    targets = [Streamer]
+    targets.extend(_subclasses(Streamer))
+    targets.extend([encoding.Hash, generic.Input, generic.Output,
+                    generic.Transaction])
+    return targets
+
+
+def _tell(f):
+    try:
+        return f.tell()
+    except (AttributeError, IOError, ValueError):
+        return 0
+
+
+class Profiler(object):
+    """ Records call counts, bytes processed and time spent in the codec
+    layer. While enabled the codec methods are swapped for instrumented
+    copies, and the originals are put back on disable, so there's no
+    overhead when profiling is off. Calls from any thread are counted, with
+    nesting tracked per thread so own time stays accurate.
+
+    Example usage::
+
+        >>> with Profiler() as prof:
+        ...     Bitcoin.transaction.from_network(stream)
+        >>> print(prof.format_table())
+
+    Setting the ``CCKIT_PROFILE`` environment variable to ``table`` or
+    ``json`` profiles the whole process and dumps the report to stderr on
+    exit.
+    """
+
+    def __init__(self, targets=None):
+        self.targets = targets
+        # (class name, method name) -> [calls, bytes, total time, own time]
+        self.stats = {}
+        self._originals = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    @property
+    def enabled(self):
+        return bool(self._originals)
+
+    def reset(self):
+        self.stats = {}
+
+    def enable(self):
+        global _active
+        if _active is not None:
+            raise Exception("A Profiler is already enabled")
+        _active = self
+        targets = self.targets
+        if targets is None:
+            targets = default_targets()
+        for cls in targets:
+            for name, attr in list(cls.__dict__.items()):
+                if name in STREAM_METHODS:
+                    measure = self._wrap_stream
+                elif name in INPUT_METHODS:
+                    measure = self._wrap_input
+                elif name in OUTPUT_METHODS:
+                    measure = self._wrap_output
+                else:
+                    continue
+                is_classmethod = isinstance(attr, classmethod)
+                func = attr.__func__ if is_classmethod else attr
+                wrapped = measure(func, name)
+                if is_classmethod:
+                    wrapped = classmethod(wrapped)
+                self._originals.append((cls, name, attr))
+                setattr(cls, name, wrapped)
+
+    def disable(self):
+        global _active
+        for cls, name, attr in reversed(self._originals):
+            setattr(cls, name, attr)
+        self._originals = []
+        if _active is self:
+            _active = None
+
+    def _call_stack(self):
+        """ The current thread's stack of time spent in nested calls """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = [0.0]
+        return stack
+
+    def _record(self, stack, owner, name, nbytes, start):
+        """ Books a finished call, tracking time spent in nested codec calls
+        so own time can be separated from the total """
+        elapsed = timer() - start
+        child = stack.pop()
+        stack[-1] += elapsed
+        if not isinstance(owner, type):
+            owner = type(owner)
+        key = (owner.__name__, name)
+        with self._lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = [0, 0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += nbytes
+            stat[2] += elapsed
+            stat[3] += elapsed - child
+
+    def _wrap_stream(self, func, name):
+        @functools.wraps(func)
+        def wrapper(owner, f, *args, **kwargs):
+            before = _tell(f)
+            stack = self._call_stack()
+            stack.append(0.0)
+            start = timer()
+            try:
+                return func(owner, f, *args, **kwargs)
+            finally:
+                self._record(stack, owner, name, _tell(f) - before, start)
+        return wrapper
+
+    def _wrap_input(self, func, name):
+        # Hex input is two characters per byte
+        divisor = 2 if name == 'from_hex' else 1
+
+        @functools.wraps(func)
+        def wrapper(owner, data, *args, **kwargs):
+            stack = self._call_stack()
+            stack.append(0.0)
+            start = timer()
+            try:
+                return func(owner, data, *args, **kwargs)
+            finally:
+                self._record(stack, owner, name, len(data) // divisor, start)
+        return wrapper
+
+    def _wrap_output(self, func, name):
+        divisor = 2 if name == 'to_hex' else 1
+
+        @functools.wraps(func)
+        def wrapper(owner, *args, **kwargs):
+            stack = self._call_stack()
+            stack.append(0.0)
+            start = timer()
+            ret = b''
+            try:
+                ret = func(owner, *args, **kwargs)
+                return ret
+            finally:
+                self._record(stack, owner, name, len(ret) // divisor,
+                             start)
+        return wrapper
+
+    def report(self):
+        """ A list of per class and method stats, most own time first """
+        rows = []
+        for (cls_name, method), stat in self.stats.items():
+            calls, nbytes, total, own = stat
+            rows.append(dict(cls=cls_name, method=method, calls=calls,
+                             bytes=nbytes, total_time=total, own_time=own))
+        rows.sort(key=lambda r: (-r['own_time'], r['cls'], r['method']))
+        return rows
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), **kwargs)
+
+    def format_table(self):
+        lines = ["{:<36} {:>10} {:>12} {:>10} {:>10} {:>9}".format(
+            "method", "calls", "bytes", "total ms", "own ms", "us/call")]
+        for row in self.report():
+            lines.append(
+                "{:<36} {:>10} {:>12} {:>10.2f} {:>10.2f} {:>9.2f}".format(
+                    row['cls'] + "." + row['method'], row['calls'],
+                    row['bytes'], row['total_time'] * 1e3,
+                    row['own_time'] * 1e3,
+                    row['total_time'] * 1e6 / row['calls']))
+        return "\n".join(lines)
+
+
+def enable_from_env(environ):
+    """ Profiles the whole process if ``CCKIT_PROFILE`` is set, dumping the
+    report to stderr in the requested format on exit. Returns the Profiler,
+    or None if profiling wasn't requested. """
+    mode = environ.get(ENV_VAR, '').lower()
+    if mode in ('', '0', 'false', 'no'):
+        return None
+    prof = Profiler()
+    prof.enable()
+
+    def dump():
+        prof.disable()
+        if mode == 'json':
+            sys.stderr.write(prof.to_json() + "\n")
+        else:
+            sys.stderr.write(prof.format_table() + "\n")
+    atexit.register(dump)
+    return prof
@@ -0,0 +1,109 @@
+import base64
+import json
+import threading
+import pytest
+
+from io import BytesIO
+
+from . import profiling
+from .bitcoin import encoding, generic
+
+
+tx_b64 = (
+    "AQAAAAEtUf3HWib/PGE4Ag4am7QPH6tuOc6W/q4yGMmuA14AqwEAAABrSDBF"
+    "AiEA5PGlIZB+UPxE0zEy7pjJcVpk350sKGDj4EdMUhq4U34CIDCvjTUGpTUu"
+    "KwVkRazYVaQtNycOlKYpp7KLIYcOxtdhASEDgIxJPwYZkNK+AB5A8EiuiHAy"
+    "C3SJXOLZZS88HHPNbyz/////AvCHSwAAAAAAGXapFPzJs204z1XX1bTuTd22"
+    "ssF2EvSMiKzwh0sAAAAAABl2qRQzzvYXSdEboq3wkaXgRWeBd/46bYisAAAA"
+    "AA==")
+
+
+def parse():
+    return generic.Transaction.from_network(BytesIO(base64.b64decode(tx_b64)))
+
+
+def test_counts_and_restore():
+    original = encoding.Int.__dict__['from_stream']
+    with profiling.Profiler() as prof:
+        assert encoding.Int.__dict__['from_stream'] is not original
+        tx = parse()
+        encoding.Int(300).to_bytes()
+    assert encoding.Int.__dict__['from_stream'] is original
+
+    stats = dict(((r['cls'], r['method']), r) for r in prof.report())
+    # Input count, output count, and one length prefix per script
+    assert stats[('Int', 'from_stream')]['calls'] == 5
+    assert stats[('String', 'from_stream')]['calls'] == 3
+    assert stats[('Input', 'from_stream')]['calls'] == 1
+    assert stats[('Output', 'from_stream')]['calls'] == 2
+    assert stats[('Hash', 'from_internal_bo')]['bytes'] == 32
+    assert stats[('Int', 'to_bytes')]['bytes'] == 3
+
+    f = BytesIO()
+    tx.to_network(f)
+    network = stats[('Transaction', 'from_network')]
+    assert network['bytes'] == len(f.getvalue())
+    assert network['own_time'] <= network['total_time']
+
+
+def test_report_formats():
+    with profiling.Profiler() as prof:
+        parse()
+    rows = json.loads(prof.to_json())
+    methods = set(r['method'] for r in rows)
+    assert methods >= set(['from_stream', 'from_network'])
+    table = prof.format_table().splitlines()
+    assert table[0].startswith("method")
+    assert len(table) == len(rows) + 1
+
+
+def test_hex_counts_bytes():
+    with profiling.Profiler() as prof:
+        encoding.String.from_hex(b'0b' + b'00' * 11).to_hex()
+    assert prof.stats[('String', 'from_hex')][1] == 12
+    assert prof.stats[('String', 'to_hex')][1] == 12
+
+
+def test_threads():
+    with profiling.Profiler() as prof:
+        threads = [threading.Thread(target=parse) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        parse()
+    calls, _, total, own = prof.stats[('Transaction', 'from_network')]
+    assert calls == 5
+    assert 0 <= own <= total
+    assert prof.stats[('Int', 'from_stream')][0] == 25
+
+
+def test_single_active():
+    with profiling.Profiler():
+        with pytest.raises(Exception):
+            profiling.Profiler().enable()
+
+
+def test_env_disabled():
+    assert profiling.enable_from_env({}) is None
+    assert profiling.enable_from_env({'CCKIT_PROFILE': '0'}) is None
+
+
+def test_env_json(monkeypatch, capsys):
+    registered = []
+    monkeypatch.setattr(profiling.atexit, 'register', registered.append)
+    original = encoding.Int.__dict__['from_stream']
+    prof = profiling.enable_from_env({'CCKIT_PROFILE': 'json'})
+    try:
+        assert prof.enabled
+        assert encoding.Int.__dict__['from_stream'] is not original
+        parse()
+        assert len(registered) == 1
+        registered[0]()
+    finally:
+        prof.disable()
+    assert encoding.Int.__dict__['from_stream'] is original
+
+    rows = json.loads(capsys.readouterr().err)
+    calls = dict(((r['cls'], r['method']), r['calls']) for r in rows)
+    assert calls[('Transaction', 'from_network')] == 1